@@ -9,15 +9,23 @@ codes necessary to look up census data for the location in question
 """
 
 
-import json
+from concurrent.futures import ProcessPoolExecutor
 import os
 from pathlib import Path
-import re
 
 # Requires geojson. Can be pip installed
 import geojson
+# Requires orjson. Can be pip installed
+import orjson
+# google-re2 is optional. Its DFA matcher doesn't backtrack over the HTML.
+# It can be pip installed, otherwise the standard library is used
+try:
+    import re2 as re
+except ImportError:
+    import re
 # Requires shapely. Can be pip installed
 from shapely.geometry import Polygon
+from shapely.strtree import STRtree
 
 
 # You will need to change these paths to match your local system
@@ -27,7 +35,13 @@ MILAN_GRID_GEOJSON = Path(DATA_DIR.parent, 'dataset/milano-grid.geojson')
 # The census codes are burried in HTML in the geojson
 # Parsing the HTML is excessive. The HTML is small enough that it's easier to
 # grab the codes like this.
-GEOJSON_CODES_REGEX = re.compile(r'<td>(?P<code>[A-za-z][^<]*)<\/td>.*?<td>(?P<val>\d+)', re.S)
+# DOTALL is set inline, since re2 doesn't take the re.S flag
+GEOJSON_CODES_REGEX = re.compile(r'(?s)<td>(?P<code>[A-za-z][^<]*)<\/td>.*?<td>(?P<val>\d+)')
+
+# Census polygons and their spatial index within a worker process of
+# create_sezioni_censimento_millan_grid_map(), see init_census_worker()
+_censusPolygons = None
+_censusTree = None
 
 
 def create_sezioni_censimento_millan_grid_map():
@@ -88,40 +102,30 @@ def create_sezioni_censimento_millan_grid_map():
 
     # If the polygons overlap, add the census information to the cell's
     # list of census blocks
-    for milanPolygon in milanPolygons:
-
-        milanArea = milanPolygon['polygon'].area
-        grid[milanPolygon['cellId']] = []
-        for censusPolygon in censusPolygons:
-
-            censusArea = censusPolygon['polygon'].area
-            if milanPolygon['polygon'].overlaps(censusPolygon['polygon']):
-
-                # Save the percentage area overlap in 'areaPercentage'
-                # and the codes in 'censusCodes'
-                # Creating a list of dictionaries with these two keys
-                intersectArea = milanPolygon['polygon'].intersection(
-                    censusPolygon['polygon']
-                ).area
-                milanAreaPercentage = intersectArea / milanArea
-                censusAreaPercentage = intersectArea / censusArea
-
-                # Round what is effectively float error
-                if milanAreaPercentage < 1e-4:
-                    milanAreaPercentage = 0
-                elif milanAreaPercentage > 0.9999:
-                    milanAreaPercentage = 1
-                if censusAreaPercentage < 1e-4:
-                    censusAreaPercentage = 0
-                elif censusAreaPercentage > 0.9999:
-                    censusAreaPercentage = 1
-
-                milanSection = {
+    # Every cell is independent, so the cells are split across processes
+    with ProcessPoolExecutor(
+        initializer=init_census_worker,
+        initargs=([censusPolygon['polygon'] for censusPolygon in censusPolygons],)
+    ) as executor:
+
+        allOverlaps = executor.map(
+            get_census_overlaps,
+            [milanPolygon['polygon'] for milanPolygon in milanPolygons],
+            chunksize=64
+        )
+        for milanPolygon, overlaps in zip(milanPolygons, allOverlaps):
+
+            # Save the percentage area overlap in 'areaPercentage'
+            # and the codes in 'censusCodes'
+            # Creating a list of dictionaries with these two keys
+            grid[milanPolygon['cellId']] = [
+                {
                     'censusAreaPercentage': censusAreaPercentage,
                     'milanAreaPercentage': milanAreaPercentage,
-                    'censusCodes': censusPolygon
+                    'censusCodes': censusPolygons[index]
                 }
-                grid[milanPolygon['cellId']].append(milanSection)
+                for index, censusAreaPercentage, milanAreaPercentage in overlaps
+            ]
 
     # Don't write the Polygons out to file
     # The polygons are a shared structure, so delete them now instead of
@@ -133,8 +137,59 @@ def create_sezioni_censimento_millan_grid_map():
             except KeyError:
                 pass
 
-    with open('milan_grid_census_codes_map_percents_both.json', 'w') as stream:
-        json.dump(grid, stream)
+    # orjson needs to be told that the integer cell ID keys are fine. They are
+    # written out as strings, same as json.dump()
+    with open('milan_grid_census_codes_map_percents_both.json', 'wb') as stream:
+        stream.write(orjson.dumps(grid, option=orjson.OPT_NON_STR_KEYS))
+
+def init_census_worker(polygons):
+    """
+    Load the census polygons into a worker process, along with the spatial
+    index over them that get_census_overlaps() queries
+    """
+
+    global _censusPolygons, _censusTree
+
+    _censusPolygons = polygons
+    _censusTree = STRtree(polygons)
+
+
+def get_census_overlaps(milanPolygon):
+    """
+    Get (census polygon index, censusAreaPercentage, milanAreaPercentage)
+    for every census polygon overlapping the Milan cell polygon, in census
+    polygon order
+
+    Runs in a worker process set up by init_census_worker()
+    """
+
+    overlaps = []
+    milanArea = milanPolygon.area
+    # Only the census polygons whose bounding box touches the cell's are
+    # tested, and the overlaps test runs inside the tree query
+    for index in sorted(_censusTree.query(milanPolygon, predicate='overlaps')):
+
+        censusPolygon = _censusPolygons[index]
+        intersectArea = milanPolygon.intersection(censusPolygon).area
+        milanAreaPercentage = intersectArea / milanArea
+        censusAreaPercentage = intersectArea / censusPolygon.area
+
+        # Round what is effectively float error
+        if milanAreaPercentage < 1e-4:
+            milanAreaPercentage = 0
+        elif milanAreaPercentage > 0.9999:
+            milanAreaPercentage = 1
+        if censusAreaPercentage < 1e-4:
+            censusAreaPercentage = 0
+        elif censusAreaPercentage > 0.9999:
+            censusAreaPercentage = 1
+
+        overlaps.append(
+            (int(index), censusAreaPercentage, milanAreaPercentage)
+        )
+
+    return overlaps
+
 
 def create_census_polygons():
 
@@ -167,8 +222,8 @@ def create_census_polygons():
 
                         censusPolygons.append(censusPolygon)
 
-    with open(CENSUS_POLYGONS_PATH, 'w') as stream:
-        json.dump(censusPolygons, stream)
+    with open(CENSUS_POLYGONS_PATH, 'wb') as stream:
+        stream.write(orjson.dumps(censusPolygons))
 
 
 if __name__ == "__main__":
@@ -11,13 +11,17 @@ Creates associated .json files as well
 """
 
 
-from itertools import chain
 import json
 from pathlib import Path
 import pickle
 import os
+import re
 
 import networkx
+import numpy as np
+# Requires orjson. Can be pip installed
+import orjson
+import pandas as pd
 
 
 # If the raw data doesn't live with this Python script, change this to match
@@ -25,65 +29,137 @@ import networkx
 DATA_DIR = Path(os.path.dirname(os.path.realpath(__file__)))
 CELL_MAPPING_PATH = Path(DATA_DIR.parent, 'MilanCensusMapping', 'milan_grid_census_codes_map.json')
 JSON_PATH = Path(DATA_DIR, 'sms-call-internet-mi.json')
+# Per input file totals, one (cell, country) pair per line, summed into
+# JSON_PATH by collect_json()
+PARTIAL_JSONL_PATH = Path(DATA_DIR, 'sms-call-internet-mi.jsonl')
 CALL_PICKLE_PATH = Path(DATA_DIR, 'call-mi.pickle')
 INTERNET_PICKLE_PATH = Path(DATA_DIR, 'internet-mi.pickle')
 SMS_PICKLE_PATH = Path(DATA_DIR, 'sms-mi.pickle')
+# Edges only copies of the graphs above. Much smaller and faster to load than
+# the pickles. See save_graph_edges()
+CALL_EDGES_PATH = CALL_PICKLE_PATH.with_suffix('.npz')
+INTERNET_EDGES_PATH = INTERNET_PICKLE_PATH.with_suffix('.npz')
+SMS_EDGES_PATH = SMS_PICKLE_PATH.with_suffix('.npz')
 COUNTRY_ABBR_PATH = Path(DATA_DIR, 'names.json')
 PHONE_ABBR_PATH = Path(DATA_DIR, 'phone.json')
 CODES_MAP_PATH = Path(DATA_DIR, 'country_codes_map.json')
-
-
-# Is string an integer? If yes, return string as integer.
-def is_int(s):
-
-    if s == '':
-        return s
-
-    try:
-        s = int(s)
-        return s
-    except ValueError:
-        return False
-
-
-# Is string a float? If yes, return string as float. 
-def is_float(s):
-
-    if s == '':
-        return s
-
-    try:
-        s = float(s)
-        return s
-    except ValueError:
-        return False
-
-
-# See description within collect_json() for more information on what validation
-# is occurring
-def validate(tokens):
-
-    if len(tokens) != 8:
-        raise ValueError(f'tokens length is not 8: {len(tokens)}')
-
-    for i, token in enumerate(tokens):
-
-        # Don't validate the timestamp. It's unused.
-        if i == 1:
-            continue
-
-        if i < 3:
-            tokens[i] = is_int(token)
-            if tokens[i] != 0 and tokens[i] == False:
-                raise ValueError(f'tokens[{i}] is not an int: {tokens[i]}')
-
-        else:
-
-            tokens[i] = is_float(token)
-            if tokens[i] != 0 and tokens[i] == False:
-                raise ValueError(f'tokens[{i}] is not a float: {tokens[i]}')
-
-    return tokens
+# Everything that isn't part of a calling code in the PHONE_ABBR_PATH json
+NON_CODE_CHARS_REGEX = re.compile(r'[^ 0-9]')
+
+
+# Columns of the raw Milan to countries tab separated files
+# See description within collect_json() for more information on each column
+COLUMNS = [
+    'cellID',
+    'timestamp',
+    'countryCode',
+    'smsIn',
+    'smsOut',
+    'callIn',
+    'callOut',
+    'cdr',
+]
+# Activity columns that also keep a count of the time periods they appear in
+COUNTED_COLUMNS = ['smsIn', 'smsOut', 'callIn', 'callOut']
+# Order of the fields within each cell to country dictionary of the JSON
+FIELDS = [
+    'smsIn',
+    'smsInCount',
+    'smsOut',
+    'smsOutCount',
+    'callIn',
+    'callInCount',
+    'callOut',
+    'callOutCount',
+    'cdr',
+]
+# Number of lines parsed at once. Bounds memory use on the multi-GB files
+CHUNK_SIZE = 1000000
+# Bytes of a file whose lines are checked at once by check_field_counts()
+CHECK_BLOCK_SIZE = 1 << 26
+
+
+# Add rows of FIELDS to the running totals of their (cell, country) pairs
+# pairs holds every (cell, country) pair seen so far, packed into one integer
+# as cellID << 32 | code, in the order they were first seen. A pair's position
+# is its row in totals. totals grows in powers of two as new pairs show up.
+# Returns the updated pairs and totals
+def accumulate(pairs, totals, cellIDs, codes, updates):
+
+    keys = (cellIDs.astype(np.int64) << 32) | codes.astype(np.int64)
+    rows = pairs.get_indexer(keys)
+
+    newKeys = np.unique(keys[rows < 0])
+    if len(newKeys):
+        pairs = pairs.append(pd.Index(newKeys))
+        rows = pairs.get_indexer(keys)
+
+        if len(pairs) > len(totals):
+            size = len(totals)
+            while size < len(pairs):
+                size *= 2
+            grown = np.zeros((size, len(FIELDS)))
+            grown[:len(totals)] = totals
+            totals = grown
+
+    np.add.at(totals, rows, updates)
+
+    return pairs, totals
+
+
+# Raise ValueError if a line of the tab separated file at filepath doesn't have
+# exactly one field per COLUMNS, empty or not
+# read_csv() pads short lines with NaN, the same as empty fields, and drops the
+# extra fields of long lines since the timestamp isn't read. The tabs of each
+# line are counted straight off the memory mapped file instead, a block of
+# whole lines at a time
+def check_field_counts(filepath):
+
+    if not filepath.stat().st_size:
+        return
+
+    data = np.memmap(filepath, dtype=np.uint8, mode='r')
+    lineNumber = 0
+    start = 0
+    while start < len(data):
+
+        # The block is grown if a single line doesn't fit in it
+        size = CHECK_BLOCK_SIZE
+        while True:
+            end = min(start + size, len(data))
+            block = data[start:end]
+            newlines = np.flatnonzero(block == ord('\n'))
+            if end == len(data) or len(newlines):
+                break
+            size *= 2
+        # The last line of the file doesn't need a newline
+        if end < len(data):
+            block = block[:newlines[-1] + 1]
+
+        lineStarts = np.concatenate(([0], newlines + 1))
+        lineStarts = lineStarts[lineStarts < len(block)]
+        tabs = np.add.reduceat(block == ord('\t'), lineStarts, dtype=np.int64)
+        bad = np.flatnonzero(tabs != len(COLUMNS) - 1)
+        if len(bad):
+            raise ValueError(
+                f'{filepath} line {lineNumber + bad[0] + 1}: '
+                f'tokens length is not {len(COLUMNS)}: {tabs[bad[0]] + 1}'
+            )
+
+        lineNumber += len(lineStarts)
+        start += len(block)
+
+
+# Iterate (cellID, code, fields) over the totals built by accumulate()
+# fields is a list of FIELDS values
+def iter_totals(pairs, totals):
+
+    keys = pairs.to_numpy()
+    return zip(
+        (keys >> 32).tolist(),
+        (keys & 0xFFFFFFFF).tolist(),
+        totals[:len(pairs)].tolist(),
+    )
 
 
 def collect_json():
@@ -91,21 +167,24 @@ def collect_json():
     if not DATA_DIR.is_dir():
         raise FileNotFoundError(DATA_DIR)
 
-    graph = {}
-    for filepath in DATA_DIR.iterdir():
-
-        if filepath.suffix != '.txt':
-            continue
+    # The totals of each file are appended to the JSON lines file once the
+    # file is done, and only summed across files at the very end. Keeps
+    # memory bounded by a single file, and the output JSON is only written
+    # once instead of after every file
+    with open(PARTIAL_JSONL_PATH, 'wb') as partialStream:
+        for filepath in DATA_DIR.iterdir():
 
-        # Sanity print
-        print(filepath)
+            if filepath.suffix != '.txt':
+                continue
 
-        with open(filepath, 'r') as stream:
+            # Sanity print
+            print(filepath)
 
             # Lines are tab separated
             # Only fields 0-2 are guaranteed. All others are optional
             # [0] is Milan cell id
-            # [1] is the timestamp that begins the 10-minute collection interval
+            # [1] is the timestamp that begins the 10-minute collection
+            #     interval
             # [2] is the country code of the relationship.
             #     0 is frequent, but not a valid country code. It made it into
             #     the graph because it's so frequent. If that proves to be
@@ -117,49 +196,100 @@ def collect_json():
             # [7] "Number of CDRs generated inside a given Square id during a
             #      given Time interval. The Internet traffic is initiated
             #      from the nation identified by the Country code"
-            #      This field is included, but it's usefulness is questionable.
+            #      This field is included, but it's usefulness is
+            #      questionable.
             #      Internet users seek out websites and web services.
-            #      The physical location of the servers hosting that content is
-            #      more likely to be related to laws and geographic proximity
-            #      than anything else.
+            #      The physical location of the servers hosting that content
+            #      is more likely to be related to laws and geographic
+            #      proximity than anything else.
             #      Values are floats.
-            for line in stream:
-
-                tokens = validate(line.split('\t'))
-                if tokens[0] not in graph:
-                    graph[tokens[0]] = {}
-                local = graph[tokens[0]]
-                if tokens[2] not in local:
-                    local[tokens[2]] = {
-                        'smsIn': 0,
-                        'smsInCount': 0,
-                        'smsOut': 0,
-                        'smsOutCount': 0,
-                        'callIn': 0,
-                        'callInCount': 0,
-                        'callOut': 0,
-                        'callOutCount': 0,
-                        'cdr': 0,
-                    }
-                local = local[tokens[2]]
-                if tokens[3]:
-                    local['smsIn'] += tokens[3]
-                    local['smsInCount'] += 1
-                if tokens[4]:
-                    local['smsOut'] += tokens[4]
-                    local['smsOutCount'] += 1
-                if tokens[5]:
-                    local['callIn'] += tokens[5]
-                    local['callInCount'] += 1
-                if tokens[6]:
-                    local['callOut'] += tokens[6]
-                    local['callOutCount'] += 1
-                if tokens[7]:
-                    local['cdr'] += tokens[7]
-
-        # Write after each file in-case we run out of memory
-        with open(JSON_PATH, 'w') as stream:
-            json.dump(graph, stream)
+            #
+            # The timestamp is unused, so it is never parsed.
+            # Empty optional fields are parsed as NaN. Lines without exactly
+            # 8 fields raise ValueError, see check_field_counts(). Other
+            # malformed fields make the parser raise.
+            # The file is memory mapped so the parser reads straight from the
+            # page cache instead of through a buffered file object
+            check_field_counts(filepath)
+            reader = pd.read_csv(
+                filepath,
+                sep='\t',
+                header=None,
+                names=COLUMNS,
+                usecols=[
+                    column for column in COLUMNS if column != 'timestamp'
+                ],
+                dtype={
+                    'cellID': np.int32,
+                    'countryCode': np.int32,
+                    'smsIn': np.float64,
+                    'smsOut': np.float64,
+                    'callIn': np.float64,
+                    'callOut': np.float64,
+                    'cdr': np.float64,
+                },
+                engine='c',
+                memory_map=True,
+                chunksize=CHUNK_SIZE,
+            )
+
+            # A pair whose values are all empty is still part of the graph
+            pairs = pd.Index([], dtype=np.int64)
+            totals = np.zeros((1024, len(FIELDS)))
+            for chunk in reader:
+
+                # Empty and zero activity values neither add to the sum nor
+                # count as a time period the connection appears in
+                values = chunk[COUNTED_COLUMNS + ['cdr']].fillna(0).to_numpy()
+                updates = np.empty((len(values), len(FIELDS)))
+                updates[:, 0:8:2] = values[:, :4]
+                updates[:, 1:8:2] = values[:, :4] != 0
+                updates[:, 8] = values[:, 4]
+
+                pairs, totals = accumulate(
+                    pairs,
+                    totals,
+                    chunk['cellID'].to_numpy(),
+                    chunk['countryCode'].to_numpy(),
+                    updates,
+                )
+
+            for cellID, code, fields in iter_totals(pairs, totals):
+                record = {'cellID': cellID, 'countryCode': code}
+                record.update(zip(FIELDS, fields))
+                partialStream.write(orjson.dumps(record) + b'\n')
+
+    if not PARTIAL_JSONL_PATH.stat().st_size:
+        return
+
+    # Sum the totals of every file
+    pairs = pd.Index([], dtype=np.int64)
+    totals = np.zeros((1024, len(FIELDS)))
+    # precise_float so the totals read back are the exact float64 values
+    # orjson wrote out. The default parser can be off in the last bit
+    for chunk in pd.read_json(
+        PARTIAL_JSONL_PATH, lines=True, chunksize=CHUNK_SIZE,
+        precise_float=True
+    ):
+        pairs, totals = accumulate(
+            pairs,
+            totals,
+            chunk['cellID'].to_numpy(),
+            chunk['countryCode'].to_numpy(),
+            chunk[FIELDS].to_numpy(np.float64),
+        )
+
+    graph = {}
+    for cellID, code, fields in iter_totals(pairs, totals):
+        fields = dict(zip(FIELDS, fields))
+        for column in COUNTED_COLUMNS:
+            fields[column + 'Count'] = int(fields[column + 'Count'])
+        graph.setdefault(cellID, {})[code] = fields
+
+    # orjson needs to be told that the integer keys are fine. They are
+    # written as strings, same as the json module does
+    with open(JSON_PATH, 'wb') as stream:
+        stream.write(orjson.dumps(graph, option=orjson.OPT_NON_STR_KEYS))
 
 
 def json_to_networkx():
@@ -174,34 +304,32 @@ def json_to_networkx():
     graphCall = networkx.Graph()
     graphSMS = networkx.Graph()
     graphInternet = networkx.Graph()
-
-    with open(JSON_PATH, 'r') as stream:
-        graphDict = json.load(stream)
-
-    for node1, innerDict in graphDict.items():
-
-        node1 = int(node1)
-
-        # Both node1 and node2 are integer values
-        # But node1 represent Milan cell IDs
-        # And node2 represents country calling codes
-        node1 = 'm' + str(node1)
-        graphCall.add_node(node1)
-        graphInternet.add_node(node1)
-        graphSMS.add_node(node1)
+    # (node1, node2, weight) edges of each graph, added in bulk at the end
+    callEdges = []
+    smsEdges = []
+    internetEdges = []
+
+    with open(JSON_PATH, 'rb') as stream:
+        graphDict = orjson.loads(stream.read())
+
+    # Both node1 and node2 are integer values
+    # But node1 represent Milan cell IDs
+    # And node2 represents country calling codes
+    # All three graphs share the same nodes, so add them once up front
+    # instead of checking for every edge
+    cells = ['m' + str(int(node1)) for node1 in graphDict]
+    countries = dict.fromkeys(
+        'c' + node2 for innerDict in graphDict.values() for node2 in innerDict
+    )
+    for graph in (graphCall, graphSMS, graphInternet):
+        graph.add_nodes_from(cells)
+        graph.add_nodes_from(countries)
+
+    for node1, innerDict in zip(cells, graphDict.values()):
 
         for node2, connectDict in innerDict.items():
 
-            # Both node1 and node2 are integer values
-            # But node1 represent Milan cell IDs
-            # And node2 represents country calling codes
             node2 = 'c' + node2
-            if node2 not in graphCall.nodes:
-                graphCall.add_node(node2)
-            if node2 not in graphInternet.nodes:
-                graphInternet.add_node(node2)
-            if node2 not in graphSMS.nodes:
-                graphSMS.add_node(node2)
 
             callWeight = 0
             smsWeight = 0
@@ -221,26 +349,26 @@ def json_to_networkx():
             if connectDict['smsOutCount'] > 0:
                 smsWeight += connectDict['smsOut'] / connectDict['smsOutCount']
 
-            try:
-                graphCall.edges[node1, node2]['weight'] += callWeight
-            except KeyError:
-                graphCall.add_edge(node1, node2, weight=callWeight)
-            try:
-                graphSMS.edges[node1, node2]['weight'] += smsWeight
-            except KeyError:
-                graphSMS.add_edge(node1, node2, weight=smsWeight)
-            try:
-                graphInternet.edges[node1, node2]['weight'] += connectDict['cdr']
-            except KeyError:
-                graphInternet.add_edge(node1, node2, weight=connectDict['cdr'])
+            # Every (cell, country) pair appears once in the JSON, so each
+            # edge is only ever added once. No need to accumulate weights
+            callEdges.append((node1, node2, callWeight))
+            smsEdges.append((node1, node2, smsWeight))
+            internetEdges.append((node1, node2, connectDict['cdr']))
 
+    graphCall.add_weighted_edges_from(callEdges)
+    graphSMS.add_weighted_edges_from(smsEdges)
+    graphInternet.add_weighted_edges_from(internetEdges)
 
     with open(CALL_PICKLE_PATH, 'wb') as stream:
-        pickle.dump(graphCall, stream)
+        pickle.dump(graphCall, stream, protocol=pickle.HIGHEST_PROTOCOL)
     with open(INTERNET_PICKLE_PATH, 'wb') as stream:
-        pickle.dump(graphInternet, stream)
+        pickle.dump(graphInternet, stream, protocol=pickle.HIGHEST_PROTOCOL)
     with open(SMS_PICKLE_PATH, 'wb') as stream:
-        pickle.dump(graphSMS, stream)
+        pickle.dump(graphSMS, stream, protocol=pickle.HIGHEST_PROTOCOL)
+
+    save_graph_edges(graphCall, CALL_EDGES_PATH)
+    save_graph_edges(graphInternet, INTERNET_EDGES_PATH)
+    save_graph_edges(graphSMS, SMS_EDGES_PATH)
 
 
 def create_country_code_map():
@@ -251,15 +379,20 @@ def create_country_code_map():
     abbrToCodes = {}
     abbrToNames = {}
     codesToAbbr = {}
-    codes = set()
-    graphCall = load_graph(CALL_PICKLE_PATH)
-    graphInternet = load_graph(INTERNET_PICKLE_PATH)
-    graphSms = load_graph(SMS_PICKLE_PATH)
-    
-    # The country codes begin with 'c'
-    for node in chain(graphCall.nodes, graphInternet.nodes, graphSms.nodes):
-        if node.startswith('c'):
-            codes.add(node[1:])
+
+    # All three cell graphs are built from the same JSON and share the same
+    # country nodes, so the call graph is enough
+    # The country codes are read straight from its .npz edges when they're up
+    # to date, which doesn't need a graph at all
+    if has_current_edges(CALL_PICKLE_PATH):
+        with np.load(CALL_EDGES_PATH) as edges:
+            codes = {str(code) for code in np.unique(edges['codes']).tolist()}
+    else:
+        # The country codes begin with 'c'
+        codes = {
+            node[1:] for node in load_graph(CALL_PICKLE_PATH).nodes
+            if isinstance(node, str) and node.startswith('c')
+        }
 
     with open(COUNTRY_ABBR_PATH, 'r') as stream:
         abbrToNames = json.load(stream)
@@ -271,9 +404,7 @@ def create_country_code_map():
         # "+", "-", and multiple codes per country
         # In the Milan data, however, they are only digits.
         # This strips the non-digits and splits the codes on spaces
-        for code in ''.join(list(
-            filter(lambda x: x in ' 0123456789', val)
-        )).split(' '):
+        for code in NON_CODE_CHARS_REGEX.sub('', val).split(' '):
             # The split can result in empty strings
             # Ignore the empty strings
             if code:
@@ -299,8 +430,65 @@ def create_country_code_map():
         json.dump(countryCodeMap, stream)
 
 
+# Write the edges of a cell-to-countries graph out as a .npz of three arrays:
+# cell IDs, country codes and weights
+# The cell-to-countries graphs carry no node attributes and every node has at
+# least one edge, so the edges alone are enough to rebuild the graph
+def save_graph_edges(graph, path):
+
+    cells = []
+    codes = []
+    weights = []
+    for node1, node2, weight in graph.edges(data='weight'):
+
+        # Undirected graph, so an edge can come out either way around
+        # Milan cells are prefixed with 'm' and countries with 'c'
+        if node1.startswith('c'):
+            node1, node2 = node2, node1
+        cells.append(int(node1[1:]))
+        codes.append(int(node2[1:]))
+        weights.append(weight)
+
+    np.savez(
+        path,
+        cells=np.array(cells, dtype=np.int32),
+        codes=np.array(codes, dtype=np.int32),
+        weights=np.array(weights, dtype=np.float64),
+    )
+
+
+# Whether the graph pickle at path has .npz edges written by save_graph_edges()
+# next to it that are at least as new as the pickle
+# A pickle written after the edges, e.g. by an older version of
+# json_to_networkx(), wins over them
+def has_current_edges(path):
+
+    edgesPath = path.with_suffix('.npz')
+    return edgesPath.exists() and (
+        not path.exists()
+        or edgesPath.stat().st_mtime >= path.stat().st_mtime
+    )
+
+
+# Load a cell-to-countries graph
+# Rebuilds the graph from the .npz edges written by save_graph_edges() if
+# they're up to date, see has_current_edges(). Falls back on the pickle
+# otherwise
 def load_graph(path):
 
+    edgesPath = path.with_suffix('.npz')
+    if has_current_edges(path):
+
+        graph = networkx.Graph()
+        with np.load(edgesPath) as edges:
+            graph.add_weighted_edges_from(zip(
+                ['m' + str(cell) for cell in edges['cells'].tolist()],
+                ['c' + str(code) for code in edges['codes'].tolist()],
+                edges['weights'].tolist(),
+            ))
+
+        return graph
+
     graph = None
     with open(path, 'rb') as stream:
         graph = pickle.load(stream)
@@ -22,7 +22,9 @@ from pathlib import Path
 import pickle
 
 import networkx
+import numpy as np
 import pandas as pd
+import scipy.sparse
 
 
 DATA_DIR = Path(os.path.dirname(os.path.realpath(__file__)))
@@ -33,11 +35,12 @@ INTERNET_CELL_GRAPH_PATH = Path(DATA_DIR, 'internet-mi.pickle')
 SMS_BLOCK_GRAPH_PATH = Path(DATA_DIR, 'sms-mi_blocks.pickle')
 SMS_CELL_GRAPH_PATH = Path(DATA_DIR, 'sms-mi.pickle')
 
-# Reverse json mapping, blocks-to-cell instead of cells-to-blocks
+# Reverse mapping, blocks-to-cell instead of cells-to-blocks
+# Parquet table written by mi_to_mi_blocks.milan_grid_census_blocks_map_reverse()
 BLOCK_MAPPING_PATH = Path(
     DATA_DIR.parent,
     'Milan-Census-Mapping',
-    'milan_grid_census_codes_map_percents_REVERSE.json'
+    'milan_grid_census_codes_map_percents_REVERSE.parquet'
 )
 # Mapping of cells to census blocks, including the percetage of cell in census
 # block, and vice-versa
@@ -78,13 +81,66 @@ def get_cell_to_block_map():
         return json.load(stream)
 
 def get_block_to_cell_map():
-    with open(BLOCK_MAPPING_PATH, 'r') as stream:
-        return json.load(stream)
+    return pd.read_parquet(
+        BLOCK_MAPPING_PATH,
+        columns=['SEZ2011', 'cellID', 'censusAreaPercentage']
+    )
 
 def get_country_codes_map():
     with open(COUNTRY_CODES_MAP_PATH, 'r') as stream:
         return json.load(stream)
 
+def get_cell_edges(cellPath):
+    """
+    Get the edges of a cell-to-countries graph as three arrays: Milan cell IDs,
+    country codes and weights
+
+    Reads the .npz edges that mi_to_countries.py writes next to the graph
+    pickle if they're at least as new as the pickle. Unpickling the whole
+    graph is much slower and needs far more memory, so the pickle is only a
+    fallback, or used when it's newer than the edges
+    """
+
+    edgesPath = cellPath.with_suffix('.npz')
+    if edgesPath.exists() and (
+        not cellPath.exists()
+        or edgesPath.stat().st_mtime >= cellPath.stat().st_mtime
+    ):
+        with np.load(edgesPath) as edges:
+            return edges['cells'], edges['codes'], edges['weights']
+
+    cellsGraph = None
+    with open(cellPath, 'rb') as stream:
+        cellsGraph = pickle.load(stream)
+
+    cells = []
+    codes = []
+    weights = []
+    for cellNode, countryNode, weight in cellsGraph.edges(data='weight'):
+
+        # Undirected graph, so an edge can come out either way around
+        # In cells graph, Milan cells are prefixed with 'm' and countries
+        # with 'c'
+        if str(cellNode).startswith('c'):
+            cellNode, countryNode = countryNode, cellNode
+
+        # Sanity check that every edge is between a Milan node and a country
+        # node
+        if not str(cellNode).startswith('m'):
+            raise ValueError(f'From Node: {str(cellNode)}')
+        if not str(countryNode).startswith('c'):
+            raise ValueError(f'To Node: {str(countryNode)}')
+
+        cells.append(int(cellNode[1:]))
+        codes.append(int(countryNode[1:]))
+        weights.append(weight)
+
+    return (
+        np.array(cells, dtype=np.int32),
+        np.array(codes, dtype=np.int32),
+        np.array(weights, dtype=np.float64),
+    )
+
 def get_block_graph(blockPath, cellPath=None):
     """
     This function is akin to create_census_blocks_graph() from
@@ -92,7 +148,7 @@ def get_block_graph(blockPath, cellPath=None):
     Milan-to-Countries
 
     Takes a base cell-to-countries graph and creates a blocks-to-countries
-    graph based off of the blocks-to-cells mapping JSON
+    graph based off of the blocks-to-cells mapping table
     """
 
     if blockPath.exists():
@@ -104,172 +160,208 @@ def get_block_graph(blockPath, cellPath=None):
             "In order to create census blocks to countries graph, a base cell "
             + "to countries graph file path is necessary"
         )
-    if not cellPath.exists():
+    if not cellPath.exists() and not cellPath.with_suffix('.npz').exists():
         raise FileNotFoundError(cellPath)
 
     blocksGraph = networkx.Graph()
-    cellsGraph = None
     blocksCellsMap = get_block_to_cell_map()
 
-    with open(cellPath, 'rb') as stream:
-        cellsGraph = pickle.load(stream)
-
-    for SEZ2011, cellsFrom in blocksCellsMap.items():
-
-        SEZ2011 = int(SEZ2011)
-        if not blocksGraph.has_node(SEZ2011):
-            blocksGraph.add_node(SEZ2011)
-
-        for cellFrom in cellsFrom:
-
-            # In cells graph, Milan cells are prefixed with 'm'
-            for cellNodeFrom, cellNodeTo, cellEdgeAttributes in cellsGraph.edges(
-                ['m' + cellFrom['cellID']], data=True
-            ):
-
-                # Sanity check that all from-nodes are indeed Milan nodes and
-                # all to-nodes are country nodes
-                if not str(cellNodeFrom).startswith('m'):
-                    raise ValueError(f'From Node: {str(cellNodeFrom)}')
-                if not str(cellNodeTo).startswith('c'):
-                    raise ValueError(f'To Node: {str(cellNodeTo)}')
-
-                if not blocksGraph.has_node(str(cellNodeTo)):
-                    blocksGraph.add_node(str(cellNodeTo))
-
-                # This is where the uniform distribution of cells and census
-                # blocks comes into play.
-                # We assume that the overlapping region of the cell and the
-                # census block perfectly mimics the distribution of call
-                # intensity over the cells, and census descriptives over the
-                # census blocks.
-                # Under this assumption, the weight is a weighted summation
-                # of all the cell-to-cell edges composing the census blocks
-                # based on the percentage of census blocks overlapping this
-                # edge.
-                #
-                # Since there are no Milan-to-Milan edges, we do not double
-                # count.
-                #
-                # Since the destination is countries and not blocks, we don't
-                # need to adjust for an overlap area in the destination like
-                # was true for the Milan-to-Milan call data.
-                # Same reason we don't look through cellToBlock mappings.
-                weight = (
-                    cellEdgeAttributes['weight']
-                    * cellFrom['censusAreaPercentage']
-                )
-
-                try:
-                    blocksGraph.edges[SEZ2011, cellNodeTo]['weight'] += weight
-                except KeyError:
-                    blocksGraph.add_edge(
-                        SEZ2011, cellNodeTo, weight=weight
-                    )
+    # Cell-to-countries weights as a sparse (cells x countries) matrix
+    cells, codes, cellWeights = get_cell_edges(cellPath)
+    cellIDs, cellRows = np.unique(cells, return_inverse=True)
+    countryCodes, countryCols = np.unique(codes, return_inverse=True)
+
+    # Percentage of each census block covered by each cell as a sparse
+    # (blocks x cells) matrix
+    # Blocks are numbered in the order they show up in the mapping
+    blockRows, blocks = pd.factorize(blocksCellsMap['SEZ2011'], sort=False)
+    blocks = blocks.tolist()
+    mappedCells = blocksCellsMap['cellID'].to_numpy()
+    # cellIDs is sorted, so a cell's column is found with a binary search
+    cellCols = np.searchsorted(cellIDs, mappedCells)
+    # Not every cell has calls
+    hasCalls = cellCols < len(cellIDs)
+    hasCalls[hasCalls] = cellIDs[cellCols[hasCalls]] == mappedCells[hasCalls]
+    blockRows = blockRows[hasCalls]
+    cellCols = cellCols[hasCalls]
+    percentages = blocksCellsMap['censusAreaPercentage'].to_numpy()[hasCalls]
+
+    cellsMatrix = scipy.sparse.csr_matrix(
+        (cellWeights, (cellRows, countryCols)),
+        shape=(len(cellIDs), len(countryCodes)),
+    )
+    blocksMatrix = scipy.sparse.csr_matrix(
+        (percentages, (blockRows, cellCols)),
+        shape=(len(blocks), len(cellIDs)),
+    )
+
+    # This is where the uniform distribution of cells and census
+    # blocks comes into play.
+    # We assume that the overlapping region of the cell and the
+    # census block perfectly mimics the distribution of call
+    # intensity over the cells, and census descriptives over the
+    # census blocks.
+    # Under this assumption, the weight is a weighted summation
+    # of all the cell-to-cell edges composing the census blocks
+    # based on the percentage of census blocks overlapping this
+    # edge.
+    # That weighted summation for every block and country at once is the
+    # product of the two matrices.
+    #
+    # Since there are no Milan-to-Milan edges, we do not double
+    # count.
+    #
+    # Since the destination is countries and not blocks, we don't
+    # need to adjust for an overlap area in the destination like
+    # was true for the Milan-to-Milan call data.
+    # Same reason we don't look through cellToBlock mappings.
+    blocksWeights = (blocksMatrix @ cellsMatrix).tocsr()
+
+    # SciPy drops products that sum to exactly 0, but a block still gets a
+    # (0 weight) edge to every country any of its cells has an edge to.
+    # Multiplying the sparsity patterns finds every one of those edges
+    blocksPattern = blocksMatrix.copy()
+    blocksPattern.data[:] = 1
+    cellsPattern = cellsMatrix.copy()
+    cellsPattern.data[:] = 1
+    edges = (blocksPattern @ cellsPattern).tocoo()
+
+    # In blocks graph, like in cells graph, countries are prefixed with 'c'
+    countries = ['c' + str(code) for code in countryCodes.tolist()]
+    blocksGraph.add_nodes_from(blocks)
+    # Country nodes are added along with their edges
+    blocksGraph.add_weighted_edges_from(zip(
+        [blocks[row] for row in edges.row.tolist()],
+        [countries[col] for col in edges.col.tolist()],
+        np.asarray(blocksWeights[edges.row, edges.col]).ravel().tolist(),
+    ))
 
     # Add census information to each node
     # For country nodes we don't have census information, but we can add
     # country name to the node (where we have it, we often don't)
     censusAttributes = get_census_attributes()
     countryCodesMap = get_country_codes_map()
-    keys = []
 
+    # Census block nodes are SEZ2011 ints, country nodes are 'c' prefixed
+    # strings
+    blockNodes = []
+    countryNodes = []
     for node in blocksGraph.nodes:
-
-        if str(node).startswith('c'):
-
-            countryCode = str(node)[1:]
-            countryName = countryCodesMap[countryCode]
-            blocksGraph.nodes[node]['CountryCode'] = countryCode
-            # Don't check for none. We want to save those Nones
-            blocksGraph.nodes[node]['CountryName'] = countryName
-
+        if isinstance(node, str):
+            countryNodes.append(node)
         else:
+            blockNodes.append(node)
+
+    for node in countryNodes:
+
+        countryCode = node[1:]
+        attrs = blocksGraph.nodes[node]
+        attrs['CountryCode'] = countryCode
+        # Don't check for none. We want to save those Nones
+        attrs['CountryName'] = countryCodesMap[countryCode]
+
+    # Not all census blocks have census data
+    # They've already been recorded by prior work
+    # We need to fill in Nones for those block nodes which don't have data,
+    # using the census keys of any block that does
+    keys = next(
+        (
+            list(censusAttributes[str(node)].keys()) for node in blockNodes
+            if str(node) in censusAttributes
+        ),
+        [],
+    )
+    for node in blockNodes:
+
+        attrs = blocksGraph.nodes[node]
+        blockAttributes = censusAttributes.get(str(node))
+        if blockAttributes:
+            attrs.update(blockAttributes)
+        else:
+            attrs.update(dict.fromkeys(keys))
 
-            # Not all census blocks have census data
-            # They've already been recorded by prior work
-            try:
-                if not keys:
-                    keys = list(censusAttributes[str(node)].keys())
-                for key, attr in censusAttributes[str(node)].items():
-                    blocksGraph.nodes[node][key] = attr
-            except KeyError:
-                pass
-
-    # We need to fill in Nones for those block nodes which don't have data
-    for (node, attrs) in blocksGraph.nodes(data=True):
-        if not str(node).startswith('c'):
-            if not attrs:
-                for key in keys:
-                    blocksGraph.nodes[node][key] = None
-            if blocksGraph.nodes[node]['SEZ2011'] is None:
-                blocksGraph.nodes[node]['SEZ2011'] = node
+        if attrs.get('SEZ2011') is None:
+            attrs['SEZ2011'] = node
 
     # Write the gtraph out
     with open(blockPath, 'wb') as stream:
-        pickle.dump(blocksGraph, stream)
+        pickle.dump(blocksGraph, stream, protocol=pickle.HIGHEST_PROTOCOL)
 
     return blocksGraph
 
 
 def graph_to_csv(graphPath):
     """
-    Since the countries nodes and census block nodes are split into two CSVs,
-    the function is called twice
-    """
-    _graph_to_csv(graphPath, True)
-    _graph_to_csv(graphPath, False)
+    Taking a block-to-country graph, create CSV files representing the graph
 
-
-def _graph_to_csv(graphPath, countries=False):
-    """
-    Taking a block-to-country graph, create a CSV file representing the graph
-
-    The CSV file is creating using Pandas in the hope that Pandas will read
-    it in without issues
+    The CSV files are created using Pandas in the hope that Pandas will read
+    them in without issues
 
     It seemed awkward to have both country nodes and census block nodes in the
-    same CSV since their attributes as so wildly different, so they will be in
-    two separate CSVs. Only one set of nodes is output in a given pass.
+    same CSV since their attributes as so wildly different, so they are in
+    two separate CSVs. The edges go in a third CSV, one row per edge, with
+    the census block as the source and the country as the destination
     """
 
-    csvPath = Path()
     graph = None
-    graphLists = []
-    keys = []
-    if countries:
-        csvPath = Path(graphPath.parent, graphPath.stem + '_countires.csv')
-    else:
-        csvPath = Path(graphPath.parent, graphPath.stem + '_blocks.csv')
-
     with open(graphPath, 'rb') as stream:
         graph = pickle.load(stream)
 
-    for (node, attrs) in graph.nodes(data=True):
+    _nodes_to_csv(
+        graph, Path(graphPath.parent, graphPath.stem + '_countires.csv'), True
+    )
+    _nodes_to_csv(
+        graph, Path(graphPath.parent, graphPath.stem + '_blocks.csv'), False
+    )
+    _edges_to_csv(graph, Path(graphPath.parent, graphPath.stem + '_edges.csv'))
 
-        # This is lazy, but works
-        if (
-            (countries and not str(node).startswith('c'))
-            or (not countries and str(node).startswith('c'))
-        ):
-            continue
 
-        if len(keys) < len(attrs.keys()):
-            keys = list(attrs.keys())
-
-        attrsList = list(attrs.values())
-        attrsList.append([])
-        for _, nodeTo, edgeAttr in graph.edges(node, data=True):
-            attrsList[-1].append((nodeTo, edgeAttr['weight']))
+def _nodes_to_csv(graph, csvPath, countries=False):
+    """
+    Write either the country nodes or the census block nodes of a
+    block-to-country graph, with their attributes, out to a CSV
 
-        graphLists.append(attrsList)
+    The "Node" column is the node as identified in the graph, which is what
+    the edges CSV refers to
+    """
 
-    keys.append('EdgeTuples')
+    # This is lazy, but works
+    nodes = {
+        node: attrs for node, attrs in graph.nodes(data=True)
+        if str(node).startswith('c') == countries
+    }
 
-    dataFrame = pd.DataFrame(graphLists, columns=keys)
+    dataFrame = pd.DataFrame.from_dict(nodes, orient='index')
+    dataFrame.index.name = 'Node'
     dataFrame.to_csv(str(csvPath))
 
 
+def _edges_to_csv(graph, csvPath):
+    """
+    Write the edges of a block-to-country graph out to a CSV with the columns
+    "Source" (census block), "Destination" (country) and "Weight"
+    """
+
+    sources = []
+    destinations = []
+    weights = []
+    for node1, node2, weight in graph.edges(data='weight'):
+
+        # Undirected graph, so an edge can come out either way around
+        if str(node1).startswith('c'):
+            node1, node2 = node2, node1
+        sources.append(node1)
+        destinations.append(node2)
+        weights.append(weight)
+
+    dataFrame = pd.DataFrame({
+        'Source': np.array(sources, dtype=np.int64),
+        'Destination': destinations,
+        'Weight': np.array(weights, dtype=np.float64),
+    })
+    dataFrame.to_csv(str(csvPath), index=False)
+
+
 if __name__ == '__main__':
     #call = get_block_graph(CALL_BLOCK_GRAPH_PATH, CALL_CELL_GRAPH_PATH)
     #internet = get_block_graph(INTERNET_BLOCK_GRAPH_PATH, INTERNET_CELL_GRAPH_PATH)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Written for Python 3.7.3
+
+Sanity check that the graphs mi_to_mi_blocks.py writes out as Parquet tables
+read back the same as they were written
+
+Raises ValueError on the first graph that doesn't
+"""
+
+
+from pathlib import Path
+import tempfile
+
+import networkx
+
+from mi_to_mi_blocks import load_graph_tables, save_graph_tables
+
+
+def get_test_graphs():
+    """
+    Get small graphs covering what the block graphs hold along the way
+    """
+
+    # As create_census_blocks_graph() writes it, no attributes at all and a
+    # block whose cells have no calls
+    blocksGraph = networkx.Graph()
+    blocksGraph.add_nodes_from([3, 159999999999, 1, 2])
+    blocksGraph.add_edge(2, 3, weight=0.5)
+    blocksGraph.add_edge(1, 3, weight=1.5)
+    blocksGraph.add_edge(2, 2, weight=0.25)
+
+    # As add_census_attributes() writes it, census fields mixing ints and
+    # strings, and a block without census information
+    attrGraph = blocksGraph.copy()
+    attrGraph.nodes[3].update(SEZ2011=3, P1=12, P2='', P3=3)
+    attrGraph.nodes[1].update(SEZ2011=1, P1='1.5', P2=7, P3=True)
+    attrGraph.nodes[2].update(SEZ2011=2, P1=0, P2=None, P3=float('nan'))
+
+    # As census_block_graph_fill_in_holes() writes it
+    filledGraph = attrGraph.copy()
+    filledGraph.nodes[159999999999].update(
+        SEZ2011=159999999999, P1=None, P2=None, P3=None
+    )
+
+    return [blocksGraph, attrGraph, filledGraph]
+
+
+def same_value(value, readValue):
+    """
+    == alone would let 12 and 12.0, or 1 and True, through, and NaN never
+    equals itself
+    """
+
+    if type(value) is not type(readValue):
+        return False
+    if value != value:
+        return readValue != readValue
+
+    return value == readValue
+
+
+def check_graph_tables():
+
+    for graph in get_test_graphs():
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            path = Path(tempDir, 'graph')
+            save_graph_tables(graph, path)
+            readGraph = load_graph_tables(path)
+
+        if list(readGraph.nodes) != list(graph.nodes):
+            raise ValueError(f'{list(graph.nodes)} {list(readGraph.nodes)}')
+
+        for node, attrs in graph.nodes(data=True):
+            readAttrs = readGraph.nodes[node]
+            if list(readAttrs) != list(attrs) or not all(
+                same_value(attr, readAttrs[key]) for key, attr in attrs.items()
+            ):
+                raise ValueError(f'{node} {attrs} {readAttrs}')
+
+        # Compared by adjacency, so the neighbours' order is checked too
+        for node, neighbours in graph.adj.items():
+            if list(readGraph.adj[node].items()) != list(neighbours.items()):
+                raise ValueError(
+                    f'{node} {dict(neighbours)} {dict(readGraph.adj[node])}'
+                )
+
+
+if __name__ == '__main__':
+    check_graph_tables()
@@ -8,7 +8,6 @@ Program to create a relation graph for Milan to Milan data
 """
 
 
-from collections import defaultdict
 import gc
 import json
 import os
@@ -16,11 +15,15 @@ from pathlib import Path
 import pickle
 
 import networkx
+import numpy as np
+import pandas as pd
 
 
 # These paths must be changed to wherever the data is
 DATA_DIR = Path(os.path.dirname(os.path.realpath(__file__)))
 CELL_MAPPING_PATH = Path(DATA_DIR.parent, 'milan_grid_census_codes_map.json')
+# Number of lines parsed at once. Bounds memory use on the ~6GB files
+CHUNK_SIZE = 2000000
 
 
 def relation_graph_to_json():
@@ -53,34 +56,70 @@ def relation_graph_to_json():
             continue
 
         index += 1
-        with open(filePath, 'r') as stream:
 
-            # Sanity check print
-            print(filePath)
-
-            graph = defaultdict(lambda: defaultdict(float))
-            for line in stream:
-
-                # Files are tab separated
-                # tokens[0] is the beginning (unix epoch) of the 10 minute time
-                #   duration
-                # tokens[1] is the from cell
-                # tokens[2] is the to cell
-                # tokens[3] is a value representing the directional interaction
-                #   strength between Square id1 and Square id2. It is
-                #   proportional to the number of calls exchanged between
-                #   callers, which are located in Square id1, and receivers
-                #   located in Square id2;
-                tokens = line.split('\t')
-                fromT = int(tokens[1])
-                toT = int(tokens[2])
-                if fromT > toT:
-                    fromT, toT = toT, fromT
-                graph[fromT][toT] += float(tokens[3])
+        # Sanity check print
+        print(filePath)
+
+        # Files are tab separated
+        # [0] is the beginning (unix epoch) of the 10 minute time duration
+        # [1] is the from cell
+        # [2] is the to cell
+        # [3] is a value representing the directional interaction
+        #   strength between Square id1 and Square id2. It is
+        #   proportional to the number of calls exchanged between
+        #   callers, which are located in Square id1, and receivers
+        #   located in Square id2;
+        #
+        # The timestamp is unused, so it is never parsed.
+        # The files are read in chunks since a whole day doesn't fit in memory
+        # The file is memory mapped so the parser reads straight from the page
+        # cache instead of through a buffered (and decoded) file object
+        reader = pd.read_csv(
+            filePath,
+            sep='\t',
+            header=None,
+            names=['timestamp', 'fromCell', 'toCell', 'weight'],
+            usecols=['fromCell', 'toCell', 'weight'],
+            dtype={
+                'fromCell': np.int32,
+                'toCell': np.int32,
+                'weight': np.float64,
+            },
+            engine='c',
+            memory_map=True,
+            chunksize=CHUNK_SIZE,
+        )
+
+        weights = None
+        for chunk in reader:
+
+            # The graph is undirected, so the smaller cell ID is always the
+            # first node of an edge
+            # Both cells are packed into a single key, smaller << 32 | larger,
+            # so grouping and summing across chunks hashes one integer
+            # instead of a pair of them
+            fromCells = chunk['fromCell'].to_numpy(np.int64)
+            toCells = chunk['toCell'].to_numpy(np.int64)
+            keys = (
+                (np.minimum(fromCells, toCells) << 32)
+                | np.maximum(fromCells, toCells)
+            )
+            chunkWeights = chunk['weight'].groupby(keys).sum()
+
+            if weights is None:
+                weights = chunkWeights
+            else:
+                weights = weights.add(chunkWeights, fill_value=0)
 
         graphDict = {}
-        for key, val in graph.items():
-            graphDict[key] = dict(val)
+        if weights is not None:
+            keys = weights.index.to_numpy()
+            for fromT, toT, weight in zip(
+                (keys >> 32).tolist(),
+                (keys & 0xFFFFFFFF).tolist(),
+                weights.tolist(),
+            ):
+                graphDict.setdefault(fromT, {})[toT] = weight
 
         with open(f'milian_to_milian_weighted_undir_graph_11_{index}.json', 'w') as stream:
             json.dump(graphDict, stream)
@@ -108,7 +147,12 @@ def aggregate_dates():
 
     for node in milanNodes:
         graph.add_node(node)
+    milanNodesArray = np.array(sorted(milanNodes), dtype=np.int64)
 
+    # Edge weights summed over all the days, indexed by the edge packed into
+    # a single key, smaller node << 32 | larger node
+    # The edges are only added to the graph once every day is read
+    weights = None
     for filePath in DATA_DIR.iterdir():
 
         if filePath.suffix != '.json':
@@ -124,29 +168,54 @@ def aggregate_dates():
         # Python is lazy about it. I ran out of memory without the hint
         gc.collect()
 
-        for node1, innerDict in dictionary.items():
-
-            node1 = int(node1)
-            if node1 not in milanNodes:
-                continue
-
-            for node2, w in innerDict.items():
-
-                node2 = int(node2)
-                if node2 not in milanNodes:
-                    continue
-
-                w = float(w)
-
-                # If the edge exists in the graph, add to the weight
-                # instead of replacing the existing weighted edge.
-                try:
-                    graph.edges[node1, node2]['weight'] += w
-                except KeyError:
-                    graph.add_edge(node1, node2, weight=w)
-
-        with open('milian_to_milian_weighted_undir_graph_aggregate_21-30.pickle', 'wb') as stream:
-            pickle.dump(graph, stream)
+        # The JSON keys are strings. Converting them all at once lets numpy
+        # parse them instead of calling int() on every single one
+        nodes1 = np.array(list(dictionary), dtype=np.int64)
+        keep = np.isin(nodes1, milanNodesArray)
+        innerDicts = [
+            innerDict
+            for innerDict, kept in zip(dictionary.values(), keep.tolist())
+            if kept
+        ]
+        nodes1 = np.repeat(
+            nodes1[keep], [len(innerDict) for innerDict in innerDicts]
+        )
+        nodes2 = np.array(
+            [node2 for innerDict in innerDicts for node2 in innerDict],
+            dtype=np.int64,
+        )
+        dayWeights = np.fromiter(
+            (w for innerDict in innerDicts for w in innerDict.values()),
+            dtype=np.float64,
+            count=len(nodes2),
+        )
+
+        keep = np.isin(nodes2, milanNodesArray)
+        nodes1 = nodes1[keep]
+        nodes2 = nodes2[keep]
+
+        # The graph is undirected, so (node1, node2) and (node2, node1) are
+        # the same edge
+        keys = (
+            (np.minimum(nodes1, nodes2) << 32) | np.maximum(nodes1, nodes2)
+        )
+        dayWeights = pd.Series(dayWeights[keep]).groupby(keys).sum()
+
+        if weights is None:
+            weights = dayWeights
+        else:
+            weights = weights.add(dayWeights, fill_value=0)
+
+    if weights is not None:
+        keys = weights.index.to_numpy()
+        graph.add_weighted_edges_from(zip(
+            (keys >> 32).tolist(),
+            (keys & 0xFFFFFFFF).tolist(),
+            weights.tolist(),
+        ))
+
+    with open('milian_to_milian_weighted_undir_graph_aggregate_21-30.pickle', 'wb') as stream:
+        pickle.dump(graph, stream, protocol=pickle.HIGHEST_PROTOCOL)
 
 # Aggregate pickles over date ranges into one NetworkX pickle
 def aggregate_pickles():
@@ -179,7 +248,7 @@ def aggregate_pickles():
     pick = None
     gc.collect()
     with open('milian_to_milian_weighted_undir_graph_aggregate_01-30.pickle', 'wb') as stream:
-        pickle.dump(netx, stream)
+        pickle.dump(netx, stream, protocol=pickle.HIGHEST_PROTOCOL)
 
 
 if __name__ == "__main__":
@@ -21,37 +21,48 @@ No fundamental reason why this was necessary (it wasn't).
 
 
 from collections import defaultdict
-import csv
-import json
 import os
 from pathlib import Path
 import pickle
 
 import networkx
+# Requires orjson. Can be pip installed
+import orjson
 import pandas as pd
+# Requires pyarrow for Parquet. Can be pip installed
+import pyarrow
+import pyarrow.parquet
 
 
 
 DATA_DIR = Path(os.path.dirname(os.path.realpath(__file__)))
-# Reverse json mapping, blocks-to-cell instead of cells-to-blocks
+# Reverse mapping, blocks-to-cell instead of cells-to-blocks
+# A table of (SEZ2011, cellID, milanAreaPercentage, censusAreaPercentage) rows,
+# see milan_grid_census_blocks_map_reverse()
 BLOCK_MAPPING_PATH = Path(
     DATA_DIR.parent,
     'Milan-Census-Mapping',
-    'milan_grid_census_codes_map_percents_REVERSE.json'
+    'milan_grid_census_codes_map_percents_REVERSE.parquet'
 )
 # Census block to census block graph
+# Stored as an edges and a nodes Parquet table, see save_graph_tables()
 BLOCK_GRAPH_PATH = Path(
     DATA_DIR,
-    'milian_to_milian_census_blocks_weighted_undir_graph_aggregate_November.pickle'
+    'milian_to_milian_census_blocks_weighted_undir_graph_aggregate_November'
 )
 # Census block to census block graph, with each node containing all census
 # attributes
 BLOCK_GRAPH_ATTR_PATH = Path(
     DATA_DIR,
-    'milian_to_milian_census_blocks_weighted_undir_graph_aggregate_November_attributes.pickle'
+    'milian_to_milian_census_blocks_weighted_undir_graph_aggregate_November_attributes'
 )
 # Census block to census block graph, with each node containing all census
-# attributes, but represented as a CSV instead of a NetworkX graph
+# attributes, but represented as a table instead of a NetworkX graph
+BLOCK_GRAPH_ATTR_TABLE_PATH = Path(
+    DATA_DIR,
+    'milian_to_milian_census_blocks_weighted_undir_graph_aggregate_November_attributes_table.parquet'
+)
+# Same as BLOCK_GRAPH_ATTR_TABLE_PATH, as a CSV
 BLOCK_GRAPH_ATTR_CSV_PATH = Path(
     DATA_DIR,
     'milian_to_milian_census_blocks_weighted_undir_graph_aggregate_November_attributes.csv'
@@ -78,17 +89,261 @@ CENSUS_DATA_JSON_PATH = Path(
 )
 # JSON list of blocks in graphs that do not have any census data
 MISSING_BLOCKS_PATH = Path(DATA_DIR, 'missing_blocks.json')
+# What int() accepts from a census CSV field
+INT_REGEX = r'\s*[-+]?\d+\s*'
+# Parquet int columns are read into the nullable pandas int types, so ints
+# next to missing values stay ints instead of becoming NaN floats
+NULLABLE_INT_TYPES = {
+    pyarrow.int8(): pd.Int8Dtype(),
+    pyarrow.int16(): pd.Int16Dtype(),
+    pyarrow.int32(): pd.Int32Dtype(),
+    pyarrow.int64(): pd.Int64Dtype(),
+}
+
+
+def graph_to_tables(graph):
+    """
+    Split a graph into an edge table and a node table
+
+    The edge table has a row per edge with the columns 'src', 'dst' and
+    'weight', in an order that adds the edges back in the same order, see
+    graph_edges_in_order().
+    The node table is the graph_nodes_table(), with the attributes holding
+    values of more than one type stored as structs, see
+    encode_mixed_types(). Nodes lacking some of the attributes list them in
+    an 'absent' column, so they aren't read back as None.
+
+    Node IDs are stored in the smallest int type that holds them. SEZ2011
+    codes don't fit in an int32.
+    """
+
+    edges = pd.DataFrame(
+        graph_edges_in_order(graph), columns=['src', 'dst', 'weight']
+    )
+    edges['src'] = pd.to_numeric(edges['src'], downcast='integer')
+    edges['dst'] = pd.to_numeric(edges['dst'], downcast='integer')
+
+    nodes = encode_mixed_types(graph_nodes_table(graph))
+    keys = list(nodes.columns[1:])
+    absent = [
+        [key for key in keys if key not in attrs] or None
+        for node, attrs in graph.nodes(data=True)
+    ]
+    if any(absent):
+        nodes['absent'] = pd.Series(absent, dtype=object)
+
+    return edges, nodes
+
+
+def graph_edges_in_order(graph):
+    """
+    Get the (src, dst, weight) of every edge, in an order that lists each
+    node's neighbours in the order of its adjacency dict
+
+    Adding the edges in graph.edges() order can reorder the adjacency dicts,
+    e.g. if the edge (2, 3) was added before (1, 3), 3's neighbours come back
+    as [1, 2] instead of [2, 1]. Each edge is taken once it's next in both of
+    its nodes' adjacency dicts, the way they were originally built up
+    """
+
+    neighbours = {node: list(adj) for node, adj in graph.adj.items()}
+    heads = dict.fromkeys(neighbours, 0)
+    edges = []
+    toCheck = list(reversed(neighbours))
+    while toCheck:
+        node = toCheck.pop()
+        while heads[node] < len(neighbours[node]):
+            neighbour = neighbours[node][heads[node]]
+            # Waits for the neighbour to get to this edge, the neighbour is
+            # checked again when it does
+            if (
+                neighbour != node
+                and neighbours[neighbour][heads[neighbour]] != node
+            ):
+                break
+            edges.append(
+                (node, neighbour, graph.adj[node][neighbour].get('weight'))
+            )
+            heads[node] += 1
+            if neighbour != node:
+                heads[neighbour] += 1
+                toCheck.append(neighbour)
+
+    return edges
+
+
+def graph_nodes_table(graph):
+    """
+    Get a table of the graph's nodes, a row per node, in node order
+
+    The node is in 'node', with a column per node attribute. Nodes without an
+    attribute hold None in its column.
+    Columns of ints are stored in the smallest nullable int type that holds
+    them, the rest hold the values as they are
+    """
+
+    nodeAttrs = dict(graph.nodes(data=True))
+    keys = dict.fromkeys(key for attrs in nodeAttrs.values() for key in attrs)
+    nodes = pd.DataFrame({
+        'node': pd.to_numeric(pd.Series(list(nodeAttrs)), downcast='integer')
+    })
+    for key in keys:
+        # Object dtype keeps ints next to None as ints instead of NaN floats,
+        # and NaN apart from None
+        nodes[key] = pd.Series(
+            [attrs.get(key) for attrs in nodeAttrs.values()], dtype=object
+        )
+        # Census counts are mostly small. The nullable int types keep None
+        if get_value_types(nodes[key]) == {int}:
+            nodes[key] = pd.to_numeric(
+                nodes[key].astype('Int64'), downcast='integer'
+            )
+
+    return nodes
+
+
+def get_value_types(column):
+    """
+    Get the set of types of the values in an object column, None excluded
+    """
+
+    return {type(value) for value in column.tolist() if value is not None}
+
+
+def encode_mixed_types(nodes):
+    """
+    Store the columns of a graph_nodes_table() holding values of more than one
+    type as structs with a field per type
+
+    A Parquet column holds a single type, but a census field can be mostly
+    ints with the odd '' or '1.5' string. Each value becomes e.g.
+    {'int': 12, 'str': None}, with only the value's own type filled in, so
+    every value reads back as the type it was
+    """
+
+    nodes = nodes.copy()
+    for key in nodes.columns[1:]:
+        if nodes[key].dtype != object:
+            continue
+        types = get_value_types(nodes[key])
+        if len(types) > 1:
+            typeNames = sorted(valueType.__name__ for valueType in types)
+            nodes[key] = pd.Series(
+                [
+                    None if value is None else {
+                        typeName: (
+                            value if typeName == type(value).__name__ else None
+                        )
+                        for typeName in typeNames
+                    }
+                    for value in nodes[key].tolist()
+                ],
+                dtype=object
+            )
+
+    return nodes
+
+
+def tables_to_graph(edges, nodes):
+    """
+    Rebuild the graph split up by graph_to_tables()
+    """
+
+    graph = networkx.Graph()
+
+    # Nodes first, so isolated nodes and the node order survive, attributes
+    # or not
+    # tolist() and object columns hand back plain Python ints and floats
+    nodeIds = nodes['node'].tolist()
+    graph.add_nodes_from(nodeIds)
+
+    keys = [key for key in nodes.columns if key not in ('node', 'absent')]
+    columns = []
+    for key in keys:
+        # The nullable int types hand back pd.NA for None
+        values = [
+            None if value is pd.NA else value for value in nodes[key].tolist()
+        ]
+        # Unpack the mixed type attributes encode_mixed_types() stored as
+        # structs
+        if any(isinstance(value, dict) for value in values):
+            values = [
+                None if value is None else next(
+                    field for field in value.values() if field is not None
+                )
+                for value in values
+            ]
+        columns.append(values)
+
+    absent = (
+        nodes['absent'].tolist() if 'absent' in nodes
+        else [None] * len(nodeIds)
+    )
+    for node, values, absentKeys in zip(nodeIds, zip(*columns), absent):
+        attrs = dict(zip(keys, values))
+        for key in absentKeys or []:
+            del attrs[key]
+        graph.nodes[node].update(attrs)
+
+    graph.add_weighted_edges_from(zip(
+        edges['src'].tolist(), edges['dst'].tolist(), edges['weight'].tolist()
+    ))
+
+    return graph
+
+
+def save_graph_tables(graph, path):
+    """
+    Write a graph out as two zstd compressed Parquet files next to each other,
+    <path>_edges.parquet and <path>_nodes.parquet
+    """
+
+    edges, nodes = graph_to_tables(graph)
+    edges.to_parquet(
+        path.with_name(f'{path.name}_edges.parquet'), compression='zstd'
+    )
+    # Built column by column so NaN attributes are kept apart from None.
+    # pandas' to_parquet() writes both as null
+    nodesTable = pyarrow.table({
+        key: pyarrow.array(nodes[key], from_pandas=False)
+        for key in nodes.columns
+    })
+    pyarrow.parquet.write_table(
+        nodesTable,
+        path.with_name(f'{path.name}_nodes.parquet'),
+        compression='zstd'
+    )
+
+
+def load_graph_tables(path):
+    """
+    Read a graph written out by save_graph_tables()
+    """
+
+    edges = pyarrow.parquet.read_table(
+        path.with_name(f'{path.name}_edges.parquet')
+    ).to_pandas(types_mapper=NULLABLE_INT_TYPES.get)
+    nodesTable = pyarrow.parquet.read_table(
+        path.with_name(f'{path.name}_nodes.parquet')
+    )
+    # Read as plain Python values. to_pandas() turns ints next to nulls into
+    # floats inside structs, and null floats into NaN
+    nodes = pd.DataFrame({
+        name: pd.Series(column.to_pylist(), dtype=object)
+        for name, column in zip(nodesTable.column_names, nodesTable.columns)
+    })
+
+    return tables_to_graph(edges, nodes)
 
 
 def get_census_blocks_graph():
     """
-    Unpickle the census block to census block graph
+    Load the census block to census block graph
 
     Graph includes census attributes on every node
     """
 
-    with open(BLOCK_GRAPH_ATTR_PATH, 'rb') as stream:
-        return pickle.load(stream)
+    return load_graph_tables(BLOCK_GRAPH_ATTR_PATH)
 
 
 def add_census_attributes():
@@ -100,61 +355,90 @@ def add_census_attributes():
     """
 
     blocksAttr = {}
-    blocksGraph = None
+    blocksGraph = load_graph_tables(BLOCK_GRAPH_PATH)
 
-    with open(BLOCK_GRAPH_PATH, 'rb') as stream:
-        blocksGraph = pickle.load(stream)
-
-    with open(CENSUS_DATA_JSON_PATH, 'r') as stream:
-        blocksAttr = json.load(stream)
+    with open(CENSUS_DATA_JSON_PATH, 'rb') as stream:
+        blocksAttr = orjson.loads(stream.read())
 
     # Some blocks are missing census information. Record what they are
     missingBlocks = set()
+    nodesAttr = {}
     for node in blocksGraph.nodes():
         try:
-            for key, attr in blocksAttr[str(node)].items():
-                blocksGraph.nodes[node][key] = attr
+            nodesAttr[node] = blocksAttr[str(node)]
         except KeyError:
             missingBlocks.add(str(node))
 
-    with open(BLOCK_GRAPH_ATTR_PATH, 'wb') as stream:
-        pickle.dump(blocksGraph, stream)
+    # Every node's attributes are set in one go
+    networkx.set_node_attributes(blocksGraph, nodesAttr)
 
-    with open(MISSING_BLOCKS_PATH, 'w') as stream:
-        json.dump(list(missingBlocks), stream)
+    save_graph_tables(blocksGraph, BLOCK_GRAPH_ATTR_PATH)
 
+    with open(MISSING_BLOCKS_PATH, 'wb') as stream:
+        stream.write(orjson.dumps(list(missingBlocks)))
 
-def create_blocks_dataframe():
-    """
-    Taking the block-to-block graph, create a CSV file representing the graph
 
-    The CSV file is creating using Pandas in the hope that Pandas will read
-    it in without issues
+def create_blocks_dataframe(asCSV=False):
+    """
+    Taking the block-to-block graph, create a Parquet file representing the
+    graph, one row per block
 
-    The tuples are represented in the CSV under the column "EdgeTuples".
-    Each EachTuple is a tuple of the form (Node, Weight)
+    The edges are represented under the column "EdgeTuples".
+    Each EachTuple is a {'Node': Node, 'Weight': Weight} struct
     Nodes are identified as in the block-to-block graph, the SEZ2011 identifier
+    Census fields that are ints for some blocks and strings for others, e.g.
+    a '' or '1.5' among the counts, are written as strings, same as the CSV
+    holds them. Missing values are null
+
+    asCSV writes the older CSV file instead, which tools without Parquet
+    support can read. Each EdgeTuple is then a tuple of the form (Node, Weight)
+    written out as text
     """
 
     blocksGraph = get_census_blocks_graph()
-    graphLists = []
-    keysList = []
-
-    for (node, attrs) in blocksGraph.nodes(data=True):
-
-        if not keysList:
-            keysList = list(attrs.keys())
 
-        attrsList = list(attrs.values())
-        attrsList.append([])
-        for nodeFrom, nodeTo, edgeAttr in blocksGraph.edges(node, data=True):
-            attrsList[-1].append((nodeTo, edgeAttr['weight']))
-
-        graphLists.append(attrsList)
-
-    keysList.append('EdgeTuples')
-
-    dataFrame = pd.DataFrame(graphLists, columns=keysList)
+    if not asCSV:
+        # SEZ2011 is the node, so the node column isn't needed
+        dataFrame = graph_nodes_table(blocksGraph).drop(columns='node')
+        # A Parquet column holds a single type. The block graph's struct
+        # encoding is kept out of this table, so plain pandas readers get
+        # a flat column
+        for key in dataFrame.columns:
+            if (
+                dataFrame[key].dtype == object
+                and len(get_value_types(dataFrame[key])) > 1
+            ):
+                dataFrame[key] = pd.Series(
+                    [
+                        None if value is None else str(value)
+                        for value in dataFrame[key].tolist()
+                    ],
+                    dtype=object
+                )
+        dataFrame['EdgeTuples'] = [
+            [
+                {'Node': neighbour, 'Weight': edgeAttr['weight']}
+                for neighbour, edgeAttr in neighbours.items()
+            ]
+            for neighbours in blocksGraph.adj.values()
+        ]
+        dataFrame.to_parquet(BLOCK_GRAPH_ATTR_TABLE_PATH, compression='zstd')
+        return
+
+    # Neighbours are read straight off the adjacency dicts, which list every
+    # undirected edge from both of its ends in the graph's own order
+    edgeTuples = {
+        node: [
+            (neighbour, edgeAttr['weight'])
+            for neighbour, edgeAttr in neighbours.items()
+        ]
+        for node, neighbours in blocksGraph.adj.items()
+    }
+
+    # All nodes have the same attributes, see census_block_graph_fill_in_holes()
+    nodes = list(blocksGraph.nodes(data=True))
+    dataFrame = pd.DataFrame([attrs for node, attrs in nodes])
+    dataFrame['EdgeTuples'] = [edgeTuples[node] for node, attrs in nodes]
     # Pandas might be able to handle a Path object
     # Also, maybe not
     # Not worth the risk since the above logic doesn't finish instantaneously,
@@ -174,28 +458,52 @@ def create_census_blocks_graph():
     cellsGraph = None
     cellsMap = {}
 
-    with open(BLOCK_MAPPING_PATH, 'r') as stream:
-        blocksMap = json.load(stream)
+    blocksTable = pd.read_parquet(
+        BLOCK_MAPPING_PATH,
+        columns=['SEZ2011', 'cellID', 'censusAreaPercentage']
+    )
     with open(CELL_GRAPH_PATH, 'rb') as stream:
         cellsGraph = pickle.load(stream)
-    with open(CELL_MAPPING_PATH, 'r') as stream:
-        cellsMap = json.load(stream)
-
+    with open(CELL_MAPPING_PATH, 'rb') as stream:
+        cellsMap = orjson.loads(stream.read())
+
+    # Keep only the (ID, censusAreaPercentage) pairs the loop below needs
+    # The blocks table rows are already grouped by block
+    for SEZ2011, cellFrom, cellPercentage in zip(
+        blocksTable['SEZ2011'].tolist(),
+        blocksTable['cellID'].tolist(),
+        blocksTable['censusAreaPercentage'].tolist(),
+    ):
+        blocksMap.setdefault(SEZ2011, []).append((cellFrom, cellPercentage))
+    # The JSON keys and codes are strings. Convert them to ints once
+    cellsMap = {
+        int(cellId): [
+            (
+                int(blockTo['censusCodes']['SEZ2011']),
+                blockTo['censusAreaPercentage']
+            )
+            for blockTo in blocksTo
+        ]
+        for cellId, blocksTo in cellsMap.items()
+    }
+
+    # Blocks in the order they're first seen, and edge weights keyed by
+    # (smaller block, larger block)
+    # Both are only added to the graph once every weight is summed
+    blockNodes = {}
+    weights = {}
+    # Plain dict lookups instead of building an EdgeDataView per cell
+    # Cells without any calls aren't in the graph, and have no edges
+    adj = cellsGraph.adj
     for SEZ2011, cellsFrom in blocksMap.items():
 
-        SEZ2011 = int(SEZ2011)
-        if not blocksGraph.has_node(SEZ2011):
-            blocksGraph.add_node(SEZ2011)
+        blockNodes[SEZ2011] = None
 
-        for cellFrom in cellsFrom:
-            for cellNodeFrom, cellNodeTo, cellEdgeAttributes in cellsGraph.edges(
-                [int(cellFrom['cellID'])], data=True
-            ):
-                for blockTo in cellsMap[str(cellNodeTo)]:
+        for cellFrom, cellPercentage in cellsFrom:
+            for cellNodeTo, cellEdgeAttributes in adj.get(cellFrom, {}).items():
+                for destSEZ2011, blockPercentage in cellsMap[cellNodeTo]:
 
-                    destSEZ2011 = int(blockTo['censusCodes']['SEZ2011'])
-                    if not blocksGraph.has_node(destSEZ2011):
-                        blocksGraph.add_node(destSEZ2011)
+                    blockNodes[destSEZ2011] = None
 
                     # This is where the uniform distribution of cells and census
                     # blocks comes into play.
@@ -214,22 +522,22 @@ def create_census_blocks_graph():
                     # just divide all intensities by 2 afterwards
                     weight = (
                         cellEdgeAttributes['weight']
-                        * cellFrom['censusAreaPercentage']
-                        * blockTo['censusAreaPercentage']
+                        * cellPercentage
+                        * blockPercentage
                     )
-                    try:
-                        blocksGraph.edges[SEZ2011, destSEZ2011]['weight'] += weight
-                    except KeyError:
-                        blocksGraph.add_edge(
-                            SEZ2011, destSEZ2011, weight=weight
-                        )
+                    if SEZ2011 <= destSEZ2011:
+                        key = (SEZ2011, destSEZ2011)
+                    else:
+                        key = (destSEZ2011, SEZ2011)
+                    weights[key] = weights.get(key, 0.0) + weight
 
+    blocksGraph.add_nodes_from(blockNodes)
     # Normalize for double counting earlier
-    for (node1, node2) in blocksGraph.edges():
-        blocksGraph.edges[node1, node2]['weight'] /= 2
+    blocksGraph.add_weighted_edges_from(
+        (node1, node2, weight / 2) for (node1, node2), weight in weights.items()
+    )
 
-    with open(BLOCK_GRAPH_PATH, 'wb') as stream:
-        pickle.dump(blocksGraph, stream)
+    save_graph_tables(blocksGraph, BLOCK_GRAPH_PATH)
 
 
 def get_census_dict():
@@ -241,8 +549,8 @@ def get_census_dict():
     """
 
     if CENSUS_DATA_JSON_PATH.exists():
-        with open(CENSUS_DATA_JSON_PATH, 'r') as stream:
-            return json.load(stream)
+        with open(CENSUS_DATA_JSON_PATH, 'rb') as stream:
+            return orjson.loads(stream.read())
 
     if not CENSUS_DATA_DIR.is_dir():
         raise FileNotFoundError(CENSUS_DATA_DIR)
@@ -264,18 +572,39 @@ def get_census_dict():
         # Robert forgot to encode the output JSON similarly
         # The output looks OK, but take that into consideration if using the
         # names directly (I doubt we will, which is why this wasn't fixed.)
-        with open(path, 'r', encoding="ISO-8859-1") as stream:
-
-            for block in csv.DictReader(stream, delimiter=';'):
-                for key, val in block.items():
-                    try:
-                        block[key] = int(val)
-                    except ValueError:
-                        pass
-                censusBlocks[block['SEZ2011']] = block
-
-    with open(CENSUS_DATA_JSON_PATH, 'w') as stream:
-        json.dump(censusBlocks, stream)
+        #
+        # Everything is read as text, the same as csv.DictReader, so empty
+        # fields stay '' and codes like '1.5' stay strings
+        frame = pd.read_csv(
+            path,
+            sep=';',
+            encoding='ISO-8859-1',
+            dtype=str,
+            keep_default_na=False,
+            engine='c',
+        )
+
+        # Values that are ints are stored as ints. Whole columns of ints are
+        # converted at once, the rest value by value
+        for key in frame.columns:
+            isInt = frame[key].str.fullmatch(INT_REGEX)
+            if isInt.all():
+                frame[key] = frame[key].astype('int64')
+            elif isInt.any():
+                frame[key] = [
+                    int(val) if valIsInt else val
+                    for val, valIsInt in zip(frame[key].tolist(), isInt.tolist())
+                ]
+
+        for block in frame.to_dict('records'):
+            censusBlocks[block['SEZ2011']] = block
+
+    # orjson needs to be told that the integer SEZ2011 keys are fine. They
+    # are written out as strings, same as json.dump()
+    with open(CENSUS_DATA_JSON_PATH, 'wb') as stream:
+        stream.write(
+            orjson.dumps(censusBlocks, option=orjson.OPT_NON_STR_KEYS)
+        )
 
     return censusBlocks
 
@@ -291,39 +620,42 @@ def census_block_graph_fill_in_holes():
     """
 
     blocksGraph = get_census_blocks_graph()
-    keys = []
-    for (node, attrs) in blocksGraph.nodes(data=True):
-        if attrs:
-            keys = attrs.keys()
-            break
-
-    for (node, attrs) in blocksGraph.nodes(data=True):
-        if not attrs:
-            for key in keys:
-                blocksGraph.nodes[node][key] = None
-        if blocksGraph.nodes[node]['SEZ2011'] is None:
-            blocksGraph.nodes[node]['SEZ2011'] = node
+    # The attributes of the first block with census information
+    keys = next(
+        (list(attrs) for (node, attrs) in blocksGraph.nodes(data=True) if attrs),
+        []
+    )
 
     # Didn't know the standard length, so just trust the first entry
     # They're all supposed to be the same.
     # A small sample is accurate, so we can trust that if all are the same
     # all are accurate
+    # The holes are filled and the lengths checked in the same pass. attrs is
+    # the node's own attribute dict, so it's filled in place
     length = -1
     for (node, attrs) in blocksGraph.nodes(data=True):
+        if not attrs:
+            attrs.update(dict.fromkeys(keys))
+        if attrs['SEZ2011'] is None:
+            attrs['SEZ2011'] = node
+
         if length < 0:
             length = len(attrs)
-        else:
-            if length != len(attrs):
-                raise ValueError(f'{node} {length} {len(attrs)}')
+        elif length != len(attrs):
+            raise ValueError(f'{node} {length} {len(attrs)}')
 
-    with open(BLOCK_GRAPH_ATTR_PATH, 'wb') as stream:
-        pickle.dump(blocksGraph, stream)
+    save_graph_tables(blocksGraph, BLOCK_GRAPH_ATTR_PATH)
 
 
 def milan_grid_census_blocks_map_reverse():
     """
     Reverse the cell-to-block mapping to create (and write out) a block-to-cell
     mapping
+
+    The mapping is written as a Parquet table with a row per overlapping block
+    and cell: SEZ2011, cellID, milanAreaPercentage, censusAreaPercentage.
+    Rows are grouped by block, in the order the blocks first show up in the
+    cell-to-block mapping
     """
 
     if not DATA_DIR.is_dir():
@@ -331,26 +663,35 @@ def milan_grid_census_blocks_map_reverse():
 
     blockMap = defaultdict(list)
     cellMap = {}
-    with open(CELL_MAPPING_PATH, 'r') as stream:
-        cellMap = json.load(stream)
+    with open(CELL_MAPPING_PATH, 'rb') as stream:
+        cellMap = orjson.loads(stream.read())
 
     for cellId, blocks in cellMap.items():
-
-        if len(blocks) == 0:
-            continue
-
         for block in blocks:
-
-            copy = {'cellID': cellId}
-            # Shallow copy
-            # No manipulations, so this is safe
-            for key, val in block.items():
-                copy[key] = val
-
-            blockMap[block['censusCodes']['SEZ2011']].append(copy)
-
-    with open(BLOCK_MAPPING_PATH, 'w') as stream:
-        json.dump(blockMap, stream)
+            blockMap[int(block['censusCodes']['SEZ2011'])].append((
+                int(cellId),
+                block['milanAreaPercentage'],
+                block['censusAreaPercentage'],
+            ))
+
+    blockTable = pd.DataFrame(
+        [
+            (SEZ2011, *cell)
+            for SEZ2011, cells in blockMap.items()
+            for cell in cells
+        ],
+        columns=[
+            'SEZ2011', 'cellID', 'milanAreaPercentage', 'censusAreaPercentage'
+        ]
+    )
+    # SEZ2011 codes don't fit in an int32, cell IDs do
+    blockTable = blockTable.astype({
+        'SEZ2011': 'int64',
+        'cellID': 'int32',
+        'milanAreaPercentage': 'float64',
+        'censusAreaPercentage': 'float64',
+    })
+    blockTable.to_parquet(BLOCK_MAPPING_PATH, compression='zstd')
 
 
 if __name__ == '__main__':
@@ -10,13 +10,20 @@ geographic regions. Some cleaning of the tweet metadata also occurs.
 
 
 from collections import defaultdict
-import json
 import os
 from pathlib import Path
+import pickle
 import urllib
 
 import geojson
-from shapely.geometry import Polygon, Point
+import numpy as np
+# Requires orjson. Can be pip installed
+import orjson
+# Requires pyarrow for Parquet. Can be pip installed
+import pandas as pd
+# Requires shapely 2. Can be pip installed
+import shapely
+from shapely.strtree import STRtree
 
 
 # Local data paths
@@ -26,15 +33,19 @@ TWITTER_GEOJSON_PATH = Path(DATA_DIR, 'social-pulse-milano.geojson')
 CELL_TWEETS_PATH = Path(DATA_DIR, 'cell_tweets.json')
 CENSUS_GEOJSON_DIR = Path(DATA_DIR.parent, 'Milan-Census-Mapping', 'CensusGeojson')
 CENSUS_POLYGONS_PATH = Path(DATA_DIR.parent, 'Milan-Census-Mapping', 'census_polygons.json')
-CENSUS_BLOCKS_TWEETS_PATH = Path(DATA_DIR, 'census_blocks_tweets.json')
+# CENSUS_POLYGONS_PATH with the polygons already built, see get_census_polygons()
+CENSUS_POLYGONS_PICKLE_PATH = CENSUS_POLYGONS_PATH.with_suffix('.pickle')
+# One row per tweet, with the census block (SEZ2011) it's in under 'block'
+CENSUS_BLOCKS_TWEETS_PATH = Path(DATA_DIR, 'census_blocks_tweets.parquet')
 
 
 def get_milan_polygons():
-"""
-Get a dictionary of Milan cells (key cell ID) to their respective polygons
-"""
+    """
+    Get a dictionary of Milan cells (key cell ID) to their respective polygons
+    """
 
-    milanPolygons = {}
+    cellIDs = []
+    rings = []
     with open(MILAN_GRID_PATH, 'r') as stream:
         geojsonDump = geojson.load(stream)
 
@@ -44,11 +55,68 @@ Get a dictionary of Milan cells (key cell ID) to their respective polygons
 
                 # For some reason there's an extra list on the cooridnates
                 # That messes up the contructor of Polygon
-                milanPolygons[feature['properties']['cellId']] = Polygon(
-                    feature['geometry']['coordinates'][0]
-                )
+                cellIDs.append(feature['properties']['cellId'])
+                rings.append(feature['geometry']['coordinates'][0])
+
+    return dict(zip(cellIDs, rings_to_polygons(rings)))
+
+
+def rings_to_polygons(rings):
+    """
+    Build a list of Polygons from a list of rings, each a list of [x, y]
+    points
+
+    All the Polygons are built at once by shapely from a single array of
+    points, instead of one Polygon() call per ring
+    """
+
+    if not rings:
+        return []
+
+    coords = np.array(
+        [point[:2] for ring in rings for point in ring], dtype=np.float64
+    )
+    # The ring each point belongs to
+    indices = np.repeat(np.arange(len(rings)), [len(ring) for ring in rings])
+
+    return shapely.polygons(
+        shapely.linearrings(coords, indices=indices)
+    ).tolist()
+
+
+def get_census_polygons():
+    """
+    Get a list of census block dictionaries, with the block's Polygon under
+    'polygon'
+
+    Building the Polygons from the raw coordinates is slow, so they are
+    pickled on the first run and read back from there while the pickle is
+    newer than CENSUS_POLYGONS_PATH
+    """
+
+    if (
+        CENSUS_POLYGONS_PICKLE_PATH.exists()
+        and CENSUS_POLYGONS_PICKLE_PATH.stat().st_mtime
+        >= CENSUS_POLYGONS_PATH.stat().st_mtime
+    ):
+        with open(CENSUS_POLYGONS_PICKLE_PATH, 'rb') as stream:
+            return pickle.load(stream)
+
+    with open(CENSUS_POLYGONS_PATH, 'rb') as stream:
+        censusPolygons = orjson.loads(stream.read())
 
-    return milanPolygons
+    # Polygon is a a raw list of floats for serialization.
+    # We want a Polygon object
+    polygons = rings_to_polygons(
+        [polygon['polygon'] for polygon in censusPolygons]
+    )
+    for censusPolygon, polygon in zip(censusPolygons, polygons):
+        censusPolygon['polygon'] = polygon
+
+    with open(CENSUS_POLYGONS_PICKLE_PATH, 'wb') as stream:
+        pickle.dump(censusPolygons, stream, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return censusPolygons
 
 
 def get_cells_tweets_map():
@@ -60,76 +128,101 @@ def get_cells_tweets_map():
 
     milanPolygons = get_milan_polygons()
     cells = defaultdict(list)
+    cellIDs = list(milanPolygons.keys())
 
-    with open(TWITTER_GEOJSON_PATH, 'r') as stream:
-        geojsons = geojson.load(stream)['features']
-
-    for tweet in geojsons:
-
-        coords = tweet['geomPoint.geom']['coordinates']
-        point = Point(coords[0], coords[1])
+    with open(TWITTER_GEOJSON_PATH, 'rb') as stream:
+        geojsons = orjson.loads(stream.read())['features']
 
-        # Brute force naive search across all cells
-        # Takes ~1 hour, but it would take more than an hour to write code that
-        # wasn't so naive.
-        for cellID, polygon in milanPolygons.items():
-            if polygon.contains(point):
+    allCoords = [tweet['geomPoint.geom']['coordinates'] for tweet in geojsons]
+    # We don't care if a tweet borders two cells. Just stuff it into the first
+    # one. Bordering on both is highly unlikely.
+    containing = get_containing_polygons(
+        list(milanPolygons.values()), allCoords
+    )
 
-                cells[cellID].append(create_tweet_dict(coords, tweet))
-                # We don't care if a tweet borders two cells. Just stuff it
-                # into one and quit searching.
-                # Bordering on both is highly unlikely.
-                break
+    for tweet, coords, index in zip(geojsons, allCoords, containing.tolist()):
+        if index >= 0:
+            cells[cellIDs[index]].append(create_tweet_dict(coords, tweet))
 
-
-    with open(CELL_TWEETS_PATH, 'w') as stream:
-        json.dump(dict(cells), stream)
+    # orjson needs to be told that the integer cell ID keys are fine. They are
+    # written out as strings, same as json.dump()
+    with open(CELL_TWEETS_PATH, 'wb') as stream:
+        stream.write(orjson.dumps(cells, option=orjson.OPT_NON_STR_KEYS))
 
 
 def get_census_tweets_map():
     """
-    Write out a JSON map of census blocks (key SEZ2011) to a list of 
-    tweets from given census blocks
+    Write out a Parquet table of the tweets in census blocks, one row per
+    tweet with the census block (SEZ2011) under 'block'
     """
 
-    blocks = defaultdict(list)
-    censusPolygons = []
+    records = []
     geojsons = {}
 
     # Census geojson data
-    with open(CENSUS_POLYGONS_PATH, 'r') as stream:
-        censusPolygons = json.load(stream)
-
-    # Polygon is a a raw list of floats for serialization.
-    # We want a Polygon object
-    for polygon in censusPolygons:
-        polygon['polygon'] = Polygon(polygon['polygon'])
+    censusPolygons = get_census_polygons()
 
     # Tweet geojson
-    with open(TWITTER_GEOJSON_PATH, 'r') as stream:
-        geojsons = geojson.load(stream)['features']
+    with open(TWITTER_GEOJSON_PATH, 'rb') as stream:
+        geojsons = orjson.loads(stream.read())['features']
+
+    allCoords = [tweet['geomPoint.geom']['coordinates'] for tweet in geojsons]
+    # We don't care if a tweet borders two block. Just stuff it into the first
+    # one. Bordering on both is highly unlikely.
+    containing = get_containing_polygons(
+        [block['polygon'] for block in censusPolygons], allCoords
+    )
+
+    for tweet, coords, index in zip(geojsons, allCoords, containing.tolist()):
+        if index >= 0:
+            records.append({
+                'block': censusPolygons[index]['SEZ2011'],
+                **create_tweet_dict(coords, tweet)
+            })
+
+    # The same few languages and users show up over and over. As categories
+    # they're stored once per file instead of once per tweet
+    tweets = pd.DataFrame(
+        records,
+        columns=[
+            'block', 'acheneID', 'coords', 'lang', 'entities', 'features',
+            'user'
+        ]
+    )
+    tweets = tweets.astype({'lang': 'category', 'user': 'category'})
+    tweets.to_parquet(CENSUS_BLOCKS_TWEETS_PATH, compression='zstd')
+
+
+def get_containing_polygons(polygons, allCoords):
+    """
+    For every [x, y] in allCoords, get the index of the first polygon in
+    polygons that contains it, or -1 if none do
 
-    for tweet in geojsons:
+    The points are built in one go and looked up together in an STRtree, so
+    each one is only tested against the polygons whose bounding box holds it
+    """
 
-        coords = tweet['geomPoint.geom']['coordinates']
-        point = Point(coords[0], coords[1])
+    coords = np.array(
+        [coords[:2] for coords in allCoords], dtype=np.float64
+    ).reshape(-1, 2)
+    points = shapely.points(coords[:, 0], coords[:, 1])
 
-        # Brute force naive search across all blocks.
-        # Takes about 45 minutes
-        for block in censusPolygons:
-            if block['polygon'].contains(point):
+    # A point is within a polygon when the polygon contains it
+    pointIndices, polygonIndices = STRtree(polygons).query(
+        points, predicate='within'
+    )
 
-                blocks[block['SEZ2011']].append(create_tweet_dict(coords, tweet))
-                # We don't care if a tweet borders two block. Just stuff it
-                # into one and quit searching.
-                # Bordering on both is highly unlikely.
-                break
+    # A point on a shared border is in several polygons. Keep the first
+    # polygon, same as a search through the polygons in order would
+    order = np.lexsort((polygonIndices, pointIndices))
+    pointIndices = pointIndices[order]
+    polygonIndices = polygonIndices[order]
+    firsts = np.unique(pointIndices, return_index=True)[1]
 
+    containing = np.full(len(coords), -1, dtype=np.int64)
+    containing[pointIndices[firsts]] = polygonIndices[firsts]
 
-    with open(CENSUS_BLOCKS_TWEETS_PATH, 'w') as stream:
-        # defaultdict may be JSON serializable, but I'm not 100% sure.
-        # Convert to dict in case.
-        json.dump(dict(blocks), stream)
+    return containing
 
 
 def prune_cell_tweets():
@@ -138,14 +231,13 @@ def prune_cell_tweets():
     """
 
     cells = {}
-    with open(CELL_TWEETS_PATH, 'r') as stream:
-        cells = json.load(stream)
+    with open(CELL_TWEETS_PATH, 'rb') as stream:
+        cells = orjson.loads(stream.read())
 
-    with open(CELL_TWEETS_PATH, 'w') as stream:
-        json.dump(
-            dict(filter(lambda item: len(item[1]) > 0, cells.items())),
-            stream
-        )
+    with open(CELL_TWEETS_PATH, 'wb') as stream:
+        stream.write(orjson.dumps(
+            dict(filter(lambda item: len(item[1]) > 0, cells.items()))
+        ))
 
 
 def create_tweet_dict(coords, tweet):
@@ -181,23 +273,15 @@ def unique_users():
     Calculate the average number across all blocks (with tweets only) as well.
     """
 
-    blockTweets = {}
-    with open(CENSUS_BLOCKS_TWEETS_PATH, 'r') as stream:
-        blockTweets = json.load(stream)
-
-    s = 0
-    n = 0
-    for block, tweets in blockTweets.items():
-
-        users = set()
-        for tweet in tweets:
-            users.add(tweet['user'])
+    # Only the two columns that are counted are read off disk. The tweet text
+    # columns (entities, features) are most of the file
+    tweets = pd.read_parquet(CENSUS_BLOCKS_TWEETS_PATH, columns=['block', 'user'])
+    users = tweets.groupby('block', sort=False)['user'].nunique()
 
-        print(block, len(users))
-        n += 1
-        s += len(users)
+    for block, count in users.items():
+        print(block, count)
 
-    print(s / n) # 12.147690069116042
+    print(users.mean()) # 12.147690069116042
 
 
 if __name__ == "__main__":
@@ -206,3 +290,4 @@ if __name__ == "__main__":
     #prune_cell_tweets()
     #get_census_tweets_map()
     #unique_users()
+    pass